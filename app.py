@@ -1,29 +1,48 @@
 import os
-import random
+import asyncio
+import colorsys
+import gzip
+import hashlib
+import mimetypes
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from functools import lru_cache
 import numpy as np
-from flask import Flask, render_template_string, request, jsonify
-from google import generativeai as genai
+import orjson
+try:
+    from numba import njit # Optional: compiles the amortization kernel when installed
+except ImportError:
+    njit = None
+from flask import Flask, Response, request, session, g, stream_with_context, send_from_directory
+from flask_compress import Compress
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
-import json # Added for formatting debt data for the prompt
+from concurrent.futures import Future
 
 # Load environment variables (especially API key)
 load_dotenv()
 
-app = Flask(__name__)
-
-# Configure the Google Generative AI client
-try:
-    # Use the API key from environment variables
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise ValueError("GEMINI_API_KEY environment variable not set.")
-    genai.configure(api_key=gemini_api_key)
-    # Select the appropriate model (using the one from the chat example)
-    model = genai.GenerativeModel('gemini-2.0-flash-lite')
-except Exception as e:
-    print(f"Error configuring GenAI: {e}")
-    # Handle the error appropriately, maybe exit or use a fallback
-    model = None
+app = Flask(__name__, static_folder=None) # /static is served by static_file() below
+# Signs the session cookie that carries each user's history id.
+# Set FLASK_SECRET_KEY when running several workers so they all accept the same cookies.
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(32)
+
+# Compress HTML (POST / pages) and JSON responses (charts, chat replies) on the fly.
+# Responses that are already compressed (the GET / shell, precompressed static files) are left
+# alone, and streamed chat replies are not compressed so each chunk reaches the browser at once.
+app.config.update(
+    COMPRESS_MIMETYPES=['text/html', 'application/json'],
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_LEVEL=6,
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_MIN_SIZE=500,
+    COMPRESS_STREAMS=False,
+)
+Compress(app)
 
 # System instruction for the AI model (from the chat example)
 SYSTEM_INSTRUCTION = """
@@ -59,14 +78,439 @@ SYSTEM_INSTRUCTION = """
 
 **Maintain Focus:** Always steer the conversation back towards analyzing the user's specific debt situation and formulating a repayment plan based *only* on the provided debt details and budget.
 """
-# Store conversation history (simple in-memory list for development)
-# WARNING: This is not suitable for production with multiple users.
-# Use Flask sessions or a database for multi-user environments.
-conversation_history = []
+# The Gemini SDK pulls in a large protobuf/gRPC import graph (about half a second), so it is
+# imported and configured on the first chat instead of at startup; page and chart requests
+# never need it.
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
 
-# Helper function to generate random colors for charts (from graph example)
-def get_random_color():
-    return f'rgb({random.randint(0,255)}, {random.randint(0,255)}, {random.randint(0,255)})'
+# Configure the Google Generative AI client
+def load_model():
+    try:
+        from google import generativeai as genai
+        # Use the API key from environment variables
+        gemini_api_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_api_key:
+            raise ValueError("GEMINI_API_KEY environment variable not set.")
+        genai.configure(api_key=gemini_api_key)
+        # Select the appropriate model (using the one from the chat example)
+        # The system instruction is set on the model so it is sent as a stable prompt prefix
+        return genai.GenerativeModel('gemini-2.0-flash-lite', system_instruction=SYSTEM_INSTRUCTION)
+    except Exception as e:
+        print(f"Error configuring GenAI: {e}")
+        # Handle the error appropriately, maybe exit or use a fallback
+        return None
+
+# Returns the configured model (None if it couldn't be configured), loading it on first use
+def get_model():
+    global _model, _model_loaded
+    with _model_lock:
+        if not _model_loaded:
+            _model = load_model()
+            _model_loaded = True
+    return _model
+
+# Conversation history is stored per browser session in SQLite, so users don't see each
+# other's turns and every gunicorn worker shares the same data.
+# Each session keeps only its last HISTORY_MAX_TURNS turns (a ring buffer that bounds the
+# prompt size) and is dropped after HISTORY_TTL_SECONDS without activity.
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH") or os.path.join(app.instance_path, "history.db")
+HISTORY_MAX_TURNS = 40
+HISTORY_TTL_SECONDS = 3600
+# The turn cap doesn't bound the size of long replies or pasted messages, so the history sent
+# with each prompt is also trimmed to roughly this many tokens (estimated at ~4 chars/token)
+HISTORY_MAX_TOKENS = 8000
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    debt_context TEXT,
+    last_active REAL NOT NULL
+);
+-- The expiry purge on every write looks sessions up by last_active
+CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_sid ON history (sid, id);
+"""
+
+os.makedirs(os.path.dirname(os.path.abspath(HISTORY_DB_PATH)), exist_ok=True)
+with closing(sqlite3.connect(HISTORY_DB_PATH)) as db:
+    db.execute("PRAGMA journal_mode=WAL") # Lets workers read while another one writes
+    db.executescript(HISTORY_SCHEMA)
+
+# One SQLite connection per request, closed on teardown
+def get_history_db():
+    if '_history_db' not in g:
+        g._history_db = sqlite3.connect(HISTORY_DB_PATH, timeout=10)
+    return g._history_db
+
+@app.teardown_appcontext
+def close_history_db(exception):
+    db = g.pop('_history_db', None)
+    if db is not None:
+        db.close()
+
+# Returns the current browser session's history id, creating one if needed
+def get_session_id():
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+# Returns (history turns, debt context) for a session, or empty values if it expired
+def load_session(sid):
+    db = get_history_db()
+    row = db.execute("SELECT debt_context, last_active FROM sessions WHERE sid = ?", (sid,)).fetchone()
+    if row is None or row[1] < time.time() - HISTORY_TTL_SECONDS:
+        return [], None
+    turns = db.execute("SELECT role, text FROM history WHERE sid = ? ORDER BY id", (sid,)).fetchall()
+    return [{"role": role, "parts": [text]} for role, text in turns], row[0]
+
+# Marks a session active and purges sessions that have expired
+def touch_session(db, sid, now):
+    expired = now - HISTORY_TTL_SECONDS
+    db.execute("DELETE FROM history WHERE sid IN (SELECT sid FROM sessions WHERE last_active < ?)", (expired,))
+    db.execute("DELETE FROM sessions WHERE last_active < ?", (expired,))
+    db.execute(
+        "INSERT INTO sessions (sid, last_active) VALUES (?, ?) "
+        "ON CONFLICT(sid) DO UPDATE SET last_active = excluded.last_active",
+        (sid, now),
+    )
+
+# Appends turns to a session's history, keeping only the last HISTORY_MAX_TURNS
+def save_turns(sid, turns):
+    db = get_history_db()
+    with db:
+        touch_session(db, sid, time.time())
+        db.executemany(
+            "INSERT INTO history (sid, role, text) VALUES (?, ?, ?)",
+            [(sid, turn["role"], turn["parts"][0]) for turn in turns],
+        )
+        db.execute(
+            "DELETE FROM history WHERE sid = ? AND id NOT IN "
+            "(SELECT id FROM history WHERE sid = ? ORDER BY id DESC LIMIT ?)",
+            (sid, sid, HISTORY_MAX_TURNS),
+        )
+
+# Stores the latest debt data submitted via the form for a session.
+# Returns True if it differs from the stored one.
+def save_debt_context(sid, debt_context):
+    db = get_history_db()
+    with db:
+        touch_session(db, sid, time.time())
+        cursor = db.execute(
+            "UPDATE sessions SET debt_context = ? WHERE sid = ? AND debt_context IS NOT ?",
+            (debt_context, sid, debt_context),
+        )
+    return cursor.rowcount > 0
+
+# Build the prompt for the API call: debt context first, then the conversation turns
+# (the system instruction is attached to the model itself).
+# The debt context is kept out of the history so it can always be sent as the first turn:
+# (system instruction + debt context) then forms a stable prompt prefix that only changes
+# when the user updates the form, which lets Gemini reuse cached prefixes.
+def build_prompt(conversation_history, debt_context):
+    prompt_for_api = []
+    if debt_context:
+        prompt_for_api.append({"role": "user", "parts": [debt_context]})
+    prompt_for_api.extend(trim_by_tokens(conversation_history))
+    return prompt_for_api
+
+# Helper function to drop the oldest turns until the rest fit in max_tokens.
+# The newest turn (the user's current message) is always kept.
+def trim_by_tokens(turns, max_tokens=HISTORY_MAX_TOKENS):
+    total = 0
+    for start in range(len(turns) - 1, -1, -1):
+        total += sum(len(part) for part in turns[start]["parts"]) // 4
+        if total > max_tokens and start < len(turns) - 1:
+            return turns[start + 1:]
+    return turns
+
+# Runs the non-streaming Gemini calls of all request threads on one background event loop.
+# Each prompt is sent with generate_content_async as soon as it is submitted, so in-flight
+# calls share a single loop and connection pool instead of each request thread driving its
+# own blocking call. Gemini has no multi-prompt request, so prompts aren't held back to be grouped.
+# At most max_concurrency calls are in flight at once (per worker), to stay within Gemini's rate limits.
+class ChatDispatcher:
+    def __init__(self, max_concurrency=16):
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+
+    # Sends a prompt from any request thread; the returned Future resolves to the reply text
+    def submit(self, prompt):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt), self._loop)
+
+    # The loop thread is started lazily so it is created inside each gunicorn worker
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            threading.Thread(target=self._run, name="chat-dispatcher", daemon=True).start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _generate(self, prompt):
+        async with self._semaphore:
+            response = await get_model().generate_content_async(prompt)
+        return response.text
+
+# Cap on in-flight Gemini calls per worker, for batched and streamed replies alike
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+
+chat_dispatcher = ChatDispatcher(max_concurrency=GEMINI_MAX_CONCURRENCY)
+
+# Streamed replies (what the chat UI uses) bypass the dispatcher and run on the request thread,
+# so they are capped by their own semaphore of the same size, held until the stream ends
+stream_semaphore = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+# In-process cache of Gemini replies, keyed by a hash of the full prompt (system instruction,
+# debt context and history), so an identical conversation state is answered without an API call.
+# Entries expire after ttl_seconds; beyond maxsize the least recently used are evicted.
+class ReplyCache:
+    def __init__(self, maxsize=1024, ttl_seconds=3600):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (expires_at, reply)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt):
+        return hashlib.sha256(orjson.dumps([SYSTEM_INSTRUCTION, prompt])).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key] # Expired
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "ttl_seconds": self.ttl_seconds,
+                    "hits": self.hits, "misses": self.misses}
+
+reply_cache = ReplyCache(maxsize=1024, ttl_seconds=3600)
+
+# Returns a Future for the reply to prompt: answered from reply_cache when possible, otherwise
+# sent through the dispatcher (and cached once it succeeds)
+def generate_reply(prompt):
+    key = ReplyCache.key(prompt)
+    cached = reply_cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    def cache_reply(done):
+        if done.exception() is None:
+            reply_cache.put(key, done.result())
+
+    future = chat_dispatcher.submit(prompt)
+    future.add_done_callback(cache_reply)
+    return future
+
+# A message repeated by the same session within this many seconds of its reply (double submit,
+# resend of the form context) gets that reply back: no new AI call and no duplicate history turns.
+# The reply cache can't catch these, since the first reply changes the history and so the prompt.
+CHAT_DEBOUNCE_SECONDS = 2.0
+
+# Session id -> (message hash, replied_at, reply) of each session's last answered message.
+# Bounded like the reply cache: beyond the limit the least recently answered sessions are evicted.
+_recent_replies = OrderedDict()
+_recent_replies_lock = threading.Lock()
+RECENT_REPLIES_MAX = 4096
+
+def message_digest(message):
+    return hashlib.blake2b(message.encode(), digest_size=16).digest()
+
+# Helper function to get the reply to a message this session just sent, or None
+def recent_reply(sid, message):
+    with _recent_replies_lock:
+        entry = _recent_replies.get(sid)
+    if entry is None or time.monotonic() - entry[1] > CHAT_DEBOUNCE_SECONDS:
+        return None
+    return entry[2] if entry[0] == message_digest(message) else None
+
+# Helper function to record the reply to a session's message for recent_reply()
+def remember_reply(sid, message, reply):
+    with _recent_replies_lock:
+        _recent_replies[sid] = (message_digest(message), time.monotonic(), reply)
+        _recent_replies.move_to_end(sid)
+        while len(_recent_replies) > RECENT_REPLIES_MAX:
+            _recent_replies.popitem(last=False)
+
+# Maximum number of "what-if" scenarios accepted by /chat_batch
+BATCH_MAX_SCENARIOS = 10
+
+# Chart palette, built once: 20 evenly spaced hues, ordered with a stride of 7 so consecutive
+# debts get clearly different colors (random RGB often gave near-identical ones)
+PALETTE = [
+    'rgb({}, {}, {})'.format(*(round(c * 255) for c in colorsys.hls_to_rgb(i * 7 % 20 / 20, 0.5, 0.6)))
+    for i in range(20)
+]
+# Matching translucent fills for the line chart's area under each balance curve
+PALETTE_FILL = [color.replace('rgb(', 'rgba(').replace(')', ', 0.1)') for color in PALETTE]
+
+# Helper function to get the chart colors for the debts at the given form positions,
+# so a debt has the same color in the line and pie charts
+def debt_colors(indices):
+    return [PALETTE[i % len(PALETTE)] for i in indices]
+
+# Helper function to get the matching area fill colors for the debts at the given form positions
+def debt_fill_colors(indices):
+    return [PALETTE_FILL[i % len(PALETTE_FILL)] for i in indices]
+
+# Serialize chart data to JSON once in Python for embedding in the page's <script>.
+# orjson is much faster than the stdlib encoder behind Jinja's tojson filter; the same
+# HTML-safe escaping is applied so values like debt names can't close the script tag.
+# Chart data holds NumPy arrays, which orjson writes directly (no tolist() pass).
+def to_script_json(obj):
+    return (orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            .replace("<", "\\u003c").replace(">", "\\u003e")
+            .replace("&", "\\u0026").replace("'", "\\u0027"))
+
+# JSON response helper: like jsonify, but serialized with orjson (faster, and it writes the
+# chart data's NumPy arrays directly)
+def ojsonify(obj):
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype='application/json')
+
+# Limit simulation to avoid extremely long schedules (e.g., 60 years)
+MONTH_LIMIT = 720
+
+# Helper function to solve the minimum-payment terms of every debt at once.
+# Works on parallel float64 arrays (one per field) so the math runs as NumPy vector ops.
+# Returns the monthly rates, the payments actually applied and the months until payoff.
+def payoff_terms(principals, rates, payments, month_limit=MONTH_LIMIT):
+    m_rates = rates / 12.0 # Monthly rates
+
+    # Ensure payment is sufficient to cover interest if rate > 0
+    min_required_payments = np.where(m_rates > 0, principals * m_rates, 0.01)
+    actual_pays = np.maximum(payments, min_required_payments * 1.001) # Use provided payment, but ensure it covers interest slightly
+
+    # Number of months until the balance reaches zero: ceil(log(pay / (pay - r_m*p0)) / log(1+r_m))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_months = np.where(
+            m_rates > 0,
+            np.ceil(np.log(actual_pays / (actual_pays - m_rates * principals)) / np.log1p(m_rates)),
+            np.ceil(principals / actual_pays),
+        )
+    # Nothing to pay off (or unusable input): month 0 only
+    n_months = np.where(np.isfinite(n_months) & (principals > 0.01), n_months, 0)
+    return m_rates, actual_pays, np.minimum(n_months, month_limit).astype(np.int64)
+
+# Helper function to flag debts whose minimum payment doesn't exceed the first month's interest.
+# Their balance never goes down, so they have no payoff schedule to chart.
+def insufficient_payments(principals, rates, payments):
+    return (principals > 0.01) & (rates / 12.0 * principals >= payments)
+
+# Growth factors (1+r_m)^k for k = 0..MONTH_LIMIT, cached per monthly rate: debts often share
+# an APR (several cards at the same rate). The array is read-only, so requests can share it.
+@lru_cache(maxsize=32)
+def growth_table(m_rate):
+    table = np.power(1 + m_rate, np.arange(MONTH_LIMIT + 1))
+    table.setflags(write=False)
+    return table
+
+# Helper function to compute every debt's balance schedule (minimum payments) at once, as a
+# (debts x months) matrix starting at month 0. Uses the closed form
+# p0*(1+r_m)^k - pay*((1+r_m)^k - 1)/r_m broadcast over the whole portfolio instead of a
+# month-by-month Python loop. Months past a debt's payoff month repeat its balance there:
+# 0 once paid off, or the last balance when capped at the month limit.
+def balance_matrix(principals, m_rates, actual_pays, n_months):
+    if not len(n_months):
+        return np.empty((0, 0))
+    k = np.minimum(np.arange(n_months.max() + 1)[None, :], n_months[:, None])
+    factor = np.take_along_axis(np.stack([growth_table(float(m)) for m in m_rates]), k, axis=1)
+    m = m_rates[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bal = np.where(
+            m > 0,
+            principals[:, None] * factor - actual_pays[:, None] * ((factor - 1) / m),
+            principals[:, None] - actual_pays[:, None] * k, # Linear ramp when there is no interest
+        )
+    return np.round(np.clip(bal, 0, None), 2) # Final payment clears the balance exactly
+
+# With Numba installed, the schedules are computed by a compiled loop over the recurrence
+# balance[k+1] = balance[k]*(1+r_m) - pay instead, which skips the temporary arrays of the
+# NumPy version. cache=True stores the compiled code on disk so only the first run compiles.
+# nogil=True releases the GIL while it runs, so charting a large portfolio doesn't stall the
+# other request threads of a gunicorn worker.
+if njit is not None:
+    numpy_balance_matrix = balance_matrix
+
+    @njit(cache=True, nogil=True)
+    def balance_matrix(principals, m_rates, actual_pays, n_months):
+        n_cols = n_months.max() + 1 if n_months.size else 0
+        out = np.empty((principals.size, n_cols))
+        for i in range(principals.size):
+            b = max(0.0, principals[i]) # Clipped at 0 like every later month (and the NumPy version)
+            for k in range(n_cols):
+                out[i, k] = b
+                if k < n_months[i]:
+                    b = max(0.0, b * (1.0 + m_rates[i]) - actual_pays[i])
+        return np.round(out, 2)
+
+    # Compile (or load from the on-disk cache) at import, with the argument types the chart
+    # code passes, so the first chart request doesn't pay for it. Only one of the two versions
+    # runs in a given environment, so the same call checks that the kernel gives the NumPy
+    # version's matrix (to the cent) on a fixed random portfolio, zero/negative principals and
+    # 0% rates included; if it doesn't, the NumPy version is used.
+    _rng = np.random.default_rng(0)
+    _principals = _rng.uniform(-1000, 50000, 200)
+    _rates = np.where(_rng.random(200) < 0.1, 0.0, _rng.uniform(0, 0.35, 200))
+    _terms = payoff_terms(_principals, _rates, _rng.uniform(0, 2000, 200))
+    if not np.allclose(balance_matrix(_principals, *_terms), numpy_balance_matrix(_principals, *_terms), rtol=0, atol=0.011):
+        print("Numba balance_matrix disagrees with the NumPy version; using the NumPy version.")
+        balance_matrix = numpy_balance_matrix
+
+# Long schedules are downsampled for the line chart to this many M4 buckets (first, last, min
+# and max point of each), i.e. at most 4 points per bucket and debt. A bucket is about one
+# column of the chart's canvas, so the drawn lines look the same with far fewer points.
+M4_BUCKETS = 100
+
+# Helper function to pick the months of a (debts x months) balance matrix to chart: the M4
+# points of every debt's schedule, merged so all datasets share one set of months.
+# Payoff months are kept (the first 0 in a bucket is its minimum).
+def m4_indices(balances, buckets=M4_BUCKETS):
+    n_cols = balances.shape[1]
+    if n_cols <= 4 * buckets:
+        return np.arange(n_cols)
+    edges = np.linspace(0, n_cols, buckets + 1).astype(np.int64)
+    keep = np.zeros(n_cols, dtype=bool)
+    keep[edges[:-1]] = True # First of each bucket
+    keep[edges[1:] - 1] = True # Last of each bucket
+    for start, stop in zip(edges[:-1], edges[1:]):
+        block = balances[:, start:stop]
+        keep[start + block.argmin(axis=1)] = True
+        keep[start + block.argmax(axis=1)] = True
+    return np.flatnonzero(keep)
 
 # Combined HTML Template (Merging Chat UI and Graph/Input UI)
 # Uses Tailwind for Chat (Left), Bootstrap for Form/Graph (Right)
@@ -78,12 +522,14 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>AI Debt Planner & Visualizer</title>
-    <!-- Tailwind CSS -->
+    <!-- Tailwind CSS (purged build when vendored, runtime JIT from the CDN otherwise) -->
+    {% if assets.tailwind_css %}
+    <link href="{{ assets.tailwind_css }}" rel="stylesheet">
+    {% else %}
     <script src="https://cdn.tailwindcss.com"></script>
+    {% endif %}
     <!-- Bootstrap CSS -->
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <!-- Chart.js -->
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <link href="{{ assets.bootstrap_css }}" rel="stylesheet">
     <style>
         /* Define the animation */
         @keyframes fadeInSlideUp {
@@ -312,8 +758,8 @@ HTML_TEMPLATE = """
 
             <section id="debt-input-section">
                 <form method="post" id="debt-form" action="/"> <!-- Action points to root to trigger calculation -->
-                    <div id="debts-list" class="space-y-4"> <!-- Added space-y for spacing between debt cards -->
-                        <!-- Debt Entry Template -->
+                    {# Debt entry markup: the form's first entry and the template addDebt() clones #}
+                    {% macro debt_entry() %}
                         <div class="card debt-entry">
                             <div class="card-body p-4"> <!-- Adjusted padding -->
                                 <div class="row g-3 align-items-end justify-center">
@@ -334,15 +780,21 @@ HTML_TEMPLATE = """
                                         <input type="number" step="0.01" min="0" name="payment" class="form-control form-control-sm" placeholder="200" required>
                                     </div>
                                     <div class="col-md-1 col-12 text-end">
-                                        <button type="button" class="btn btn-outline-danger btn-sm btn-remove p-1 leading-none" onclick="removeDebt(this)" title="Remove Debt">
+                                        <button type="button" class="btn btn-outline-danger btn-sm btn-remove p-1 leading-none" title="Remove Debt">
                                             <svg xmlns="http://www.w3.org/2000/svg" class="h-4 w-4" fill="none" viewBox="0 0 24 24" stroke="currentColor" stroke-width="2"> <path stroke-linecap="round" stroke-linejoin="round" d="M6 18L18 6M6 6l12 12" /> </svg>
                                         </button>
                                     </div>
                                 </div>
                             </div>
                         </div>
-                        <!-- End Debt Entry Template -->
+                    {% endmacro %}
+                    <div id="debts-list" class="space-y-4"> <!-- Added space-y for spacing between debt cards -->
+                        {{ debt_entry() }}
                     </div>
+                    <!-- Pristine debt entry (empty inputs) cloned by addDebt() -->
+                    <template id="debt-tpl">
+                        {{ debt_entry() }}
+                    </template>
                     <div class="mt-4 d-flex justify-content-between align-items-center"> <!-- Adjusted margin and alignment -->
                         <button type="button" class="btn btn-success btn-sm" onclick="addDebt()">
                             <svg xmlns="http://www.w3.org/2000/svg" class="h-4 w-4 inline-block -mt-0.5 mr-1" fill="none" viewBox="0 0 24 24" stroke="currentColor" stroke-width="2"> <path stroke-linecap="round" stroke-linejoin="round" d="M12 4v16m8-8H4" /> </svg>
@@ -353,21 +805,18 @@ HTML_TEMPLATE = """
                 </form>
             </section>
 
-            {% if chart_data or pie_chart_data %}
-            <section class="results-section">
+            <section class="results-section d-none" id="results-section">
                 <h3 class="text-center mb-4 text-lg font-semibold text-gray-700">Repayment Visualization</h3>
-                 {% if chart_data %}
-                 <div class="chart-container">
+                 <div class="chart-container d-none" id="balance-chart-container">
                     <div class="card">
                         <div class="card-header">Repayment Schedule Over Time (Min. Payments)</div>
                         <div class="card-body">
                              <canvas id="balanceChart" style="min-height: 250px;"></canvas> <!-- Added min-height -->
+                             <p class="small text-danger mt-2 mb-0 d-none" id="insufficient-warning"></p>
                         </div>
                     </div>
                  </div>
-                 {% endif %}
-                 {% if pie_chart_data %}
-                 <div class="chart-container">
+                 <div class="chart-container d-none" id="pie-chart-container">
                      <div class="card">
                         <div class="card-header">Initial Debt Distribution</div>
                         <div class="card-body">
@@ -375,12 +824,9 @@ HTML_TEMPLATE = """
                         </div>
                     </div>
                  </div>
-                 {% endif %}
                  <p class="text-muted text-center mt-3 small">Note: The line chart shows estimated payoff time if only minimum payments are made. Ask the AI planner about faster strategies like Snowball or Avalanche!</p>
             </section>
-            {% else %}
-             <p class="text-center text-muted mt-5">Submit your debt details above to generate visualizations.</p>
-            {% endif %}
+            <p class="text-center text-muted mt-5" id="results-placeholder">Submit your debt details above to generate visualizations.</p>
         </div> <!-- End Graph Column -->
 
     </div> <!-- End Main Container -->
@@ -424,6 +870,18 @@ HTML_TEMPLATE = """
             chatbox.appendChild(messageContainer);
             // Smooth scroll to bottom
             chatbox.scrollTo({ top: chatbox.scrollHeight, behavior: 'smooth' });
+            return messageP; // Lets streamed replies append text to the bubble
+        }
+
+        // Parse one Server-Sent Event block ("event: ...\\ndata: {...}") into { event, data }
+        function parseSseEvent(rawEvent) {
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            return { event, data: data ? JSON.parse(data) : {} };
         }
 
         // Function to gather debt data from the form
@@ -465,10 +923,11 @@ HTML_TEMPLATE = """
             const currentDebtData = getDebtDataFromForm();
 
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
+                        'Accept': 'text/event-stream', // Stream the reply as it is generated
                     },
                     // Send both the user message and the current debt data
                     body: JSON.stringify({
@@ -482,8 +941,27 @@ HTML_TEMPLATE = """
                     throw new Error(`HTTP error! status: ${response.status} - ${errorData.reply || errorData.error || 'Server Error'}`);
                 }
 
-                const data = await response.json();
-                addMessage('AI', data.reply);
+                // Append each streamed chunk to the AI bubble as it arrives
+                const replyP = addMessage('AI', '');
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const rawEvents = buffer.split('\\n\\n');
+                    buffer = rawEvents.pop(); // Keep an incomplete event for the next read
+                    for (const rawEvent of rawEvents) {
+                        const { event, data } = parseSseEvent(rawEvent);
+                        if (event === 'error') {
+                            replyP.textContent = data.reply;
+                        } else if (data.delta) {
+                            replyP.textContent += data.delta;
+                            chatbox.scrollTo({ top: chatbox.scrollHeight });
+                        }
+                    }
+                }
 
             } catch (error) {
                 console.error('Error sending message:', error);
@@ -514,28 +992,12 @@ HTML_TEMPLATE = """
 
 
         // --- Graph/Form Functionality ---
+        // Pristine debt entry, parsed once from the <template>: its inputs are already empty
+        const DEBT_TPL = document.getElementById('debt-tpl').content.firstElementChild;
+
         function addDebt(){
             const list = document.getElementById('debts-list');
-            const template = list.querySelector('.debt-entry'); // Use first entry as template
-            if (!template) {
-                console.error("Debt entry template not found!");
-                return; // Avoid errors if template is somehow missing
-            }
-            const newEntry = template.cloneNode(true);
-
-            // Clear input values in the cloned entry
-            newEntry.querySelectorAll('input').forEach(input => input.value = '');
-            // Ensure the remove button is present and functional (it's cloned)
-            const removeBtn = newEntry.querySelector('.btn-remove');
-            if (removeBtn) {
-                removeBtn.onclick = function() { removeDebt(this); }; // Re-attach listener
-            } else {
-                 // If the template somehow lost its button, add one (basic fallback)
-                 const buttonDiv = newEntry.querySelector('.text-end');
-                 if(buttonDiv) {
-                     buttonDiv.innerHTML = `<button type="button" class="btn btn-outline-danger btn-sm btn-remove p-1 leading-none" onclick="removeDebt(this)" title="Remove Debt"> <svg xmlns="http://www.w3.org/2000/svg" class="h-4 w-4" fill="none" viewBox="0 0 24 24" stroke="currentColor" stroke-width="2"> <path stroke-linecap="round" stroke-linejoin="round" d="M6 18L18 6M6 6l12 12" /> </svg> </button>`;
-                 }
-            }
+            const newEntry = DEBT_TPL.cloneNode(true);
 
             // Optional: Add animation class for new entry appearance
             newEntry.style.opacity = '0'; // Start transparent
@@ -547,16 +1009,12 @@ HTML_TEMPLATE = """
             newEntry.style.transform = 'translateY(0)'; // Assuming a slight translateY was used initially
 
             // Focus the first input of the new entry
-            const firstInput = newEntry.querySelector('input[name="name"]');
-            if (firstInput) {
-                firstInput.focus();
-            }
+            newEntry.querySelector('input[name="name"]').focus();
         }
 
-        function removeDebt(button) {
-            const debtEntry = button.closest('.debt-entry');
+        function removeDebt(debtEntry) {
             // Only remove if more than one entry exists
-            if (document.querySelectorAll('#debts-list .debt-entry').length > 1) {
+            if (document.getElementById('debts-list').childElementCount > 1) {
                  // Optional: Add fade-out animation
                  debtEntry.style.transition = 'opacity 0.3s ease-out, transform 0.3s ease-out';
                  debtEntry.style.opacity = '0';
@@ -569,89 +1027,118 @@ HTML_TEMPLATE = """
             }
         }
 
-        // Ensure at least one debt entry exists on load (if none rendered from server)
-        document.addEventListener('DOMContentLoaded', function() {
-            if (document.querySelectorAll('#debts-list .debt-entry').length === 0) {
-                // If the template exists in HTML but was hidden by Jinja, we might need a different approach
-                // For now, assume addDebt() correctly creates one if needed.
-                // Consider adding a hidden template in the HTML if server-side rendering might leave it empty.
-                console.log("No debt entries found on load, attempting to add one.");
-                // We need a template to clone from, ensure one exists or create dynamically
-                // This part might need adjustment based on how the initial HTML is structured
-                // If the first entry is always rendered (even if empty), this check might not be needed.
-                // addDebt(); // This might fail if no template exists initially
-            }
+        // One delegated listener serves every entry's remove button, including ones added later
+        document.getElementById('debts-list').addEventListener('click', function(e) {
+            const removeBtn = e.target.closest('.btn-remove');
+            if (removeBtn) removeDebt(removeBtn.closest('.debt-entry'));
+        });
 
-            // --- Chart Initialization (if data exists) ---
-            const chartOptionsBase = {
-                responsive: true,
-                maintainAspectRatio: false, // Allow chart to resize
-                plugins: {
-                    legend: { position: 'top', labels: { boxWidth: 12, padding: 15, font: { size: 10 } } },
-                    title: { display: false }, // Title is in card header
-                    tooltip: {
-                        mode: 'index',
-                        intersect: false,
-                        callbacks: {
-                            label: function(context) {
-                                let label = context.dataset.label || '';
-                                if (label) {
-                                    label += ': ';
-                                }
-                                if (context.parsed.y !== null) {
-                                    label += new Intl.NumberFormat('en-US', { style: 'currency', currency: 'USD' }).format(context.parsed.y);
-                                }
-                                return label;
+        // --- Chart Rendering ---
+        // Charts are drawn from plain JSON: either embedded by the server when the form was
+        // posted the classic way, or fetched from /api/charts when the form is submitted.
+        const INITIAL_CHARTS = {{ charts_json | safe }};
+
+        const chartOptionsBase = {
+            responsive: true,
+            maintainAspectRatio: false, // Allow chart to resize
+            plugins: {
+                legend: { position: 'top', labels: { boxWidth: 12, padding: 15, font: { size: 10 } } },
+                title: { display: false }, // Title is in card header
+                tooltip: {
+                    mode: 'index',
+                    intersect: false,
+                    callbacks: {
+                        label: function(context) {
+                            let label = context.dataset.label || '';
+                            if (label) {
+                                label += ': ';
+                            }
+                            if (context.parsed.y !== null) {
+                                label += new Intl.NumberFormat('en-US', { style: 'currency', currency: 'USD' }).format(context.parsed.y);
                             }
+                            return label;
                         }
                     }
-                },
-                interaction: {
-                    mode: 'index',
-                    intersect: false,
-                },
-                animation: {
-                    duration: 800, // Animation duration in ms
-                    easing: 'easeInOutQuart' // Smoother easing
                 }
-            };
-
-            {% if chart_data %}
-            const ctxLine = document.getElementById('balanceChart')?.getContext('2d');
-            if (ctxLine) {
-                // Create gradient fills for line chart areas (optional enhancement)
-                const createGradient = (ctx, color) => {
-                    const gradient = ctx.createLinearGradient(0, 0, 0, ctx.canvas.height);
-                    const rgbaColor = color.replace('rgb', 'rgba').replace(')', ', 0.4)'); // Base color with alpha
-                    const rgbaColorEnd = color.replace('rgb', 'rgba').replace(')', ', 0.05)'); // Fading to transparent
-                    gradient.addColorStop(0, rgbaColor);
-                    gradient.addColorStop(1, rgbaColorEnd);
-                    return gradient;
-                };
-
-                new Chart(ctxLine, {
+            },
+            interaction: {
+                mode: 'index',
+                intersect: false,
+            },
+            animation: {
+                duration: 800, // Animation duration in ms
+                easing: 'easeInOutQuart' // Smoother easing
+            }
+        };
+
+        let balanceChart = null;
+        let pieChart = null;
+
+        // Chart.js is only fetched once there are charts to draw, not on the empty landing page
+        const CHART_JS_URL = {{ assets.chart_js | tojson }};
+        let chartJsLoaded = null;
+        function loadChartJs() {
+            if (!chartJsLoaded) {
+                chartJsLoaded = new Promise((resolve, reject) => {
+                    const script = document.createElement('script');
+                    script.src = CHART_JS_URL;
+                    script.onload = resolve;
+                    script.onerror = () => {
+                        chartJsLoaded = null; // Retry on the next submission
+                        reject(new Error('Could not load Chart.js'));
+                    };
+                    document.head.appendChild(script);
+                });
+            }
+            return chartJsLoaded;
+        }
+
+        async function renderCharts(charts) {
+            const chartData = charts ? charts.chart_data : null;
+            const pieChartData = charts ? charts.pie_chart_data : null;
+            if (chartData || pieChartData) {
+                await loadChartJs();
+            }
+
+            // Show only the sections that have data
+            const hasResults = Boolean(chartData || pieChartData);
+            document.getElementById('results-section').classList.toggle('d-none', !hasResults);
+            document.getElementById('results-placeholder').classList.toggle('d-none', hasResults);
+            document.getElementById('balance-chart-container').classList.toggle('d-none', !chartData);
+            document.getElementById('pie-chart-container').classList.toggle('d-none', !pieChartData);
+
+            // Replace the charts from a previous submission
+            if (balanceChart) { balanceChart.destroy(); balanceChart = null; }
+            if (pieChart) { pieChart.destroy(); pieChart = null; }
+
+            // Debts whose minimum payment doesn't exceed the interest are left off the line chart
+            const insufficient = chartData ? chartData.insufficient : [];
+            const warning = document.getElementById('insufficient-warning');
+            warning.textContent = insufficient.length
+                ? `Not charted (minimum payment doesn't exceed the monthly interest): ${insufficient.join(', ')}`
+                : '';
+            warning.classList.toggle('d-none', !insufficient.length);
+
+            if (chartData) {
+                const ctxLine = document.getElementById('balanceChart').getContext('2d');
+                balanceChart = new Chart(ctxLine, {
                     type: 'line',
                     data: {
-                        labels: {{ chart_data.months | tojson }},
-                        datasets: [
-                            {% for d in chart_data.datasets %}
-                            {
-                                label: '{{ d.label }}',
-                                data: {{ d.data | tojson }},
-                                borderColor: '{{ d.color }}',
-                                // backgroundColor: createGradient(ctxLine, '{{ d.color }}'), // Use gradient fill
-                                backgroundColor: '{{ d.color | replace("rgb", "rgba") | replace(")", ", 0.1)") }}', // Simpler fill
-                                fill: true, // Enable area fill
-                                tension: 0.3, // Smoother curve
-                                pointBackgroundColor: '{{ d.color }}',
-                                pointBorderColor: '#fff',
-                                pointHoverBackgroundColor: '#fff',
-                                pointHoverBorderColor: '{{ d.color }}',
-                                pointRadius: 2, // Smaller points
-                                pointHoverRadius: 4
-                            }{% if not loop.last %},{% endif %}
-                            {% endfor %}
-                        ]
+                        labels: chartData.months,
+                        datasets: chartData.datasets.map(d => ({
+                            label: d.label,
+                            data: d.data,
+                            borderColor: d.color,
+                            backgroundColor: d.fill_color,
+                            fill: true, // Enable area fill
+                            tension: 0.3, // Smoother curve
+                            pointBackgroundColor: d.color,
+                            pointBorderColor: '#fff',
+                            pointHoverBackgroundColor: '#fff',
+                            pointHoverBorderColor: d.color,
+                            pointRadius: 2, // Smaller points
+                            pointHoverRadius: 4
+                        }))
                     },
                     options: {
                         ...chartOptionsBase, // Spread base options
@@ -666,6 +1153,9 @@ HTML_TEMPLATE = """
                                 }
                             },
                             x: {
+                                 type: 'linear', // Month numbers: long schedules are downsampled unevenly
+                                 min: 0,
+                                 max: chartData.months[chartData.months.length - 1],
                                  title: { display: true, text: 'Months', font: { size: 12 } },
                                  ticks: {
                                      maxTicksLimit: 15 // Limit number of x-axis labels shown
@@ -675,19 +1165,17 @@ HTML_TEMPLATE = """
                     }
                 });
             }
-            {% endif %}
 
-            {% if pie_chart_data %}
-            const ctxPie = document.getElementById('debtPieChart')?.getContext('2d');
-            if (ctxPie) {
-                 new Chart(ctxPie, {
+            if (pieChartData) {
+                const ctxPie = document.getElementById('debtPieChart').getContext('2d');
+                pieChart = new Chart(ctxPie, {
                     type: 'pie',
                     data: {
-                        labels: {{ pie_chart_data.labels | tojson }},
+                        labels: pieChartData.labels,
                         datasets: [{
                             label: 'Initial Debt Amount',
-                            data: {{ pie_chart_data.data | tojson }},
-                            backgroundColor: {{ pie_chart_data.colors | tojson }},
+                            data: pieChartData.data,
+                            backgroundColor: pieChartData.colors,
                             hoverOffset: 8, // Larger hover offset
                             borderColor: '#ffffff', // White border between slices
                             borderWidth: 1
@@ -719,182 +1207,361 @@ HTML_TEMPLATE = """
                     }
                 });
             }
-            {% endif %}
+        }
+
+        // Ensure at least one debt entry exists on load (if none rendered from server)
+        document.addEventListener('DOMContentLoaded', function() {
+            if (document.getElementById('debts-list').childElementCount === 0) {
+                addDebt();
+            }
+
+            // --- Chart Initialization (if data exists) ---
+            renderCharts(INITIAL_CHARTS).catch(error => console.error('Error drawing charts:', error));
+
+            // Submit the debt form in the background and redraw the charts from the JSON API,
+            // so the page itself is never re-rendered
+            // ETag of the charts on screen; unchanged inputs come back as a 304
+            let chartsEtag = null;
+            document.getElementById('debt-form').addEventListener('submit', async function(e) {
+                e.preventDefault();
+                try {
+                    const headers = chartsEtag ? { 'If-None-Match': chartsEtag } : {};
+                    const response = await fetch('/api/charts', { method: 'POST', body: new FormData(this), headers: headers });
+                    if (response.status === 304) {
+                        return; // Same inputs as the charts already drawn
+                    }
+                    const charts = await response.json();
+                    if (!response.ok) {
+                        throw new Error(charts.error || `HTTP error! status: ${response.status}`);
+                    }
+                    chartsEtag = response.headers.get('ETag');
+                    await renderCharts(charts);
+                } catch (error) {
+                    console.error('Error calculating graph data:', error);
+                    chartsEtag = null;
+                    await renderCharts(null);
+                }
+            });
         });
 
     </script>
     <!-- Bootstrap JS Bundle -->
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
+    <script src="{{ assets.bootstrap_js }}" defer></script>
 </body>
 </html>
 """
 
-@app.route('/', methods=['GET','POST'])
-def index():
+STATIC_DIR = os.path.join(app.root_path, 'static')
+
+# Front-end bundles: (file in static/vendor, CDN fallback). ./build_assets.sh vendors them;
+# until it has run, the page loads them from their CDNs.
+VENDOR_ASSETS = {
+    'tailwind_css': ('tailwind.min.css', None), # None: the template falls back to the Tailwind JIT script
+    'bootstrap_css': ('bootstrap.min.css', 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css'),
+    'chart_js': ('chart.umd.min.js', 'https://cdn.jsdelivr.net/npm/chart.js'),
+    'bootstrap_js': ('bootstrap.bundle.min.js', 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'),
+}
+
+# Content hash of each vendored bundle, by its path under /static
+def vendor_versions():
+    versions = {}
+    for filename, _ in VENDOR_ASSETS.values():
+        path = os.path.join(STATIC_DIR, 'vendor', filename)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                versions[f"vendor/{filename}"] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return versions
+
+VENDOR_VERSIONS = vendor_versions()
+
+# URL of each bundle: the vendored file tagged with its content hash, so browsers can cache it
+# for good (a new build gets a new URL), or the CDN URL when it hasn't been vendored
+def asset_urls():
+    urls = {}
+    for key, (filename, cdn_url) in VENDOR_ASSETS.items():
+        version = VENDOR_VERSIONS.get(f"vendor/{filename}")
+        urls[key] = f"/static/vendor/{filename}?v={version}" if version else cdn_url
+    return urls
+
+# Compile the template once at import instead of re-parsing it on every request
+_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE, globals={'assets': asset_urls()})
+
+# The page without chart data is the same for every visitor: render it once at import and
+# keep a gzipped copy, so GET / does no template work and sends several times fewer bytes.
+INDEX_HTML = _TEMPLATE.render(charts_json='null').encode('utf-8')
+INDEX_HTML_GZIP = gzip.compress(INDEX_HTML, compresslevel=9)
+INDEX_HTML_ETAG = hashlib.sha1(INDEX_HTML).hexdigest()
+
+def compute_charts(names, principals, rates, payments):
+    """
+    Computes the line chart (balances under minimum payments) and pie chart data.
+    Pure function of its inputs.
+    """
+    pie_chart_data = None
+
+    # --- Line Chart Data Calculation (Based on Minimum Payments) ---
+    # Filter out any debts with invalid data ("nan" and "inf" parse as floats): one mask for all debts
+    valid = np.isfinite(principals) & np.isfinite(rates) & np.isfinite(payments)
+    # Debts that never get paid down are listed instead of charted
+    insufficient = insufficient_payments(principals, rates, payments)
+    valid_indices = np.flatnonzero(valid).tolist()
+    line_indices = np.flatnonzero(valid & ~insufficient).tolist()
+    m_rates, actual_pays, n_months = payoff_terms(principals, rates, payments)
+
+    # One row per charted debt, as long as the longest schedule (month 0 included)
+    balances = balance_matrix(principals[line_indices], m_rates[line_indices],
+                              actual_pays[line_indices], n_months[line_indices])
+
+    line_chart_colors = debt_colors(line_indices)
+    line_chart_fills = debt_fill_colors(line_indices)
+
+    # Labels correspond to end of month balance (month 0 included). Long schedules keep only
+    # the months needed to draw them; the chart's x axis is linear, so the spacing is preserved.
+    months_labels = m4_indices(balances)
+    if len(months_labels) < balances.shape[1]:
+        balances = balances[:, months_labels]
+
+    # Each dataset's data is a row of the matrix; orjson serializes the arrays directly
+    datasets = [
+        {'label': names[i], 'data': data, 'color': color, 'fill_color': fill_color}
+        for i, data, color, fill_color in zip(line_indices, balances, line_chart_colors, line_chart_fills)
+    ]
+
+    chart_data = {
+        'months': months_labels,
+        'datasets': datasets,
+        'insufficient': [names[i] for i in np.flatnonzero(valid & insufficient)],
+    }
+
+    # --- Pie Chart Data Calculation (Initial Distribution) ---
+    valid_principals = principals[valid_indices]
+    valid_names = [names[i] for i in valid_indices]
+
+    if valid_names: # Only create pie chart if there's valid data
+        pie_labels = valid_names
+        pie_data = valid_principals
+        pie_colors = debt_colors(valid_indices) # Same colors as the line chart
+
+        pie_chart_data = {
+            'labels': pie_labels,
+            'data': pie_data,
+            'colors': pie_colors
+        }
+
+    return chart_data, pie_chart_data
+
+# The debt form's fields, in the order they are hashed for the ETag
+DEBT_FORM_FIELDS = ('name', 'principal', 'rate', 'payment')
+
+# ETag of a debt form submission: a hash of the raw field values in submission order
+# (dataset order follows the form). blake2b is fast and plenty for cache keying.
+def debt_form_etag(form):
+    fields = [form.getlist(field) for field in DEBT_FORM_FIELDS]
+    return hashlib.blake2b(orjson.dumps(fields), digest_size=16).hexdigest()
+
+def parse_debt_form(form):
+    """
+    Parses the debt form into names plus contiguous float64 arrays (one per numeric field).
+    Returns (names, principals, rates_percent, rates, payments); raises ValueError on bad input.
+    """
+    names = form.getlist('name')
+    # np.asarray converts the strings to floats in a C loop (and raises ValueError on bad input)
+    principals = np.asarray(form.getlist('principal'), dtype=np.float64)
+    rates_percent = np.asarray(form.getlist('rate'), dtype=np.float64)
+    rates = np.clip(rates_percent, 0, None) / 100
+    payments = np.asarray(form.getlist('payment'), dtype=np.float64)
+
+    if not (len(names) == len(principals) == len(rates) == len(payments)):
+         raise ValueError("Form data mismatch") # Basic validation
+
+    return names, principals, rates_percent, rates, payments
+
+def store_debt_context(names, principals, rates_percent, rates, payments):
+    """Stores the submitted debt data as the conversation's debt context."""
+    insufficient = insufficient_payments(principals, rates, payments)
+    # Build the per-debt records only here, where they are serialized into text
+    submitted_debt_data = [
+        {
+            'name': name,
+            'principal': float(p),
+            'rate': float(rate_pct), # Store original percentage for clarity in history
+            'payment': float(pay),
+            'insufficient': bool(short)
+        }
+        for name, p, rate_pct, pay, short in zip(names, principals, rates_percent, payments, insufficient)
+        if name
+    ]
+    if submitted_debt_data: # Only add if we successfully parsed some data
+        # Collect the pieces and join once instead of growing the string with +=
+        parts = ["[Debt data submitted via form]\n", "Current Debt Information:\n"]
+        for debt in submitted_debt_data:
+            name = debt.get('name', 'N/A')
+            principal = debt.get('principal', 0)
+            rate = debt.get('rate', 0) # Already in percent from parsing logic above
+            payment = debt.get('payment', 0)
+            parts.append(f"- Name: {name}, Principal: ${principal:,.2f}, APR: {rate}%, Min Payment: ${payment:,.2f}")
+            if debt['insufficient']:
+                parts.append(" (minimum payment does not exceed the monthly interest, so this balance never decreases)")
+            parts.append("\n")
+        debt_context_string = "".join(parts)
+
+        # Replace the previous context; an identical resubmit leaves the prompt prefix unchanged
+        if save_debt_context(get_session_id(), debt_context_string):
+             print("DEBUG: Updated debt context for the conversation.") # Optional debug print
+
+def process_debt_form(form):
     """
-    Handles rendering the main page (GET) and processing the debt form
-    to generate graph data (POST). Also stores submitted debt data in history.
+    Computes the line and pie chart data for the submitted debt form and stores
+    the submitted debt data as the conversation's debt context.
+    Returns (chart_data, pie_chart_data); both are None if the form can't be processed.
     """
-    global conversation_history # Ensure we can modify the global history
     chart_data = None
     pie_chart_data = None
-    submitted_debt_data = [] # Store submitted data for history
 
-    if request.method == 'POST':
-        try:
-            names = request.form.getlist('name')
-            principals = list(map(float, request.form.getlist('principal')))
-            rates_percent = request.form.getlist('rate')
-            rates = [(float(r)/100) if float(r) >= 0 else 0 for r in rates_percent]
-            payments = list(map(float, request.form.getlist('payment')))
-
-            if not (len(names) == len(principals) == len(rates) == len(payments)):
-                 raise ValueError("Form data mismatch") # Basic validation
-
-            # Store valid submitted data for history
-            for i in range(len(names)):
-                 # Basic check if data seems valid before adding to history list
-                 if names[i] and isinstance(principals[i], float) and isinstance(rates[i], float) and isinstance(payments[i], float):
-                     submitted_debt_data.append({
-                         'name': names[i],
-                         'principal': principals[i],
-                         'rate': float(rates_percent[i]), # Store original percentage for clarity in history
-                         'payment': payments[i]
-                     })
-
-            # --- Line Chart Data Calculation (Based on Minimum Payments) ---
-            max_months = 0
-            balances_over_time = []
-            line_chart_colors = []
-
-            for p0, r, pay, name in zip(principals, rates, payments, names):
-                # Ensure all inputs are valid numbers before proceeding
-                if not all(isinstance(val, (int, float)) for val in [p0, r, pay]):
-                    print(f"Skipping invalid data for debt: {name}")
-                    continue # Skip this debt if data is invalid
-
-                bal = []
-                p = p0
-                m_rate = r / 12.0 # Monthly rate
-
-                # Ensure payment is sufficient to cover interest if rate > 0
-                min_required_payment = p * m_rate if m_rate > 0 else 0.01
-                actual_pay = max(pay, min_required_payment * 1.001) # Use provided payment, but ensure it covers interest slightly
-
-                # Limit simulation to avoid extremely long calculations (e.g., 60 years)
-                month_limit = 720
-                current_month = 0
-                bal.append(round(p, 2)) # Start with initial balance at month 0
-
-                while p > 0.01 and current_month < month_limit:
-                    interest = p * m_rate
-                    # Prevent payment from being less than interest if it's the minimum possible
-                    payment_this_month = actual_pay
-                    if p < payment_this_month: # Final payment logic
-                         payment_this_month = p + interest
-
-                    principal_paid = payment_this_month - interest
-                    p -= principal_paid
-                    p = max(p, 0) # Ensure balance doesn't go negative
-
-                    bal.append(round(p, 2))
-                    current_month += 1
-
-                     # Safety break: If balance isn't decreasing, stop after a while
-                    if current_month > 12 and len(bal) > 10 and bal[-1] >= bal[-10] * 0.9999:
-                        print(f"Warning: Balance for '{name}' not decreasing significantly. Stopping calculation.")
-                        # Fill remaining months up to limit with the last balance to show it plateaus
-                        last_balance = bal[-1]
-                        while len(bal) < month_limit + 1: # +1 because we start at month 0
-                            bal.append(last_balance)
-                        p = 0 # Force exit outer loop
-
-                max_months = max(max_months, len(bal))
-                balances_over_time.append(bal)
-                line_chart_colors.append(get_random_color())
-
-            # Pad shorter balances list to match max_months for charting
-            padded_balances = []
-            for bal in balances_over_time:
-                padding_needed = max_months - len(bal)
-                # Pad with the last value (0 if paid off, last balance if plateaued)
-                last_val = bal[-1] if bal else 0
-                padded_balances.append(bal + [last_val] * padding_needed)
-
-            # months_labels = list(range(0, max_months)) # Start from month 0
-            months_labels = list(range(max_months)) # Labels correspond to end of month balance
-
-            datasets = []
-            # Filter out any debts that failed validation earlier
-            valid_indices = [i for i, p, r, pay in zip(range(len(principals)), principals, rates, payments)
-                             if all(isinstance(val, (int, float)) for val in [p, r, pay])]
-
-            for i, idx in enumerate(valid_indices):
-                 if i < len(padded_balances): # Ensure we have balance data for this index
-                    datasets.append({
-                        'label': names[idx],
-                        'data': padded_balances[i],
-                        'color': line_chart_colors[i]
-                    })
-
-            chart_data = {'months': months_labels, 'datasets': datasets}
-
-            # --- Pie Chart Data Calculation (Initial Distribution) ---
-            valid_principals = [principals[i] for i in valid_indices]
-            valid_names = [names[i] for i in valid_indices]
-
-            if valid_principals: # Only create pie chart if there's valid data
-                pie_labels = valid_names
-                pie_data = valid_principals
-                pie_colors = [get_random_color() for _ in valid_names] # Generate colors for pie chart
-
-                pie_chart_data = {
-                    'labels': pie_labels,
-                    'data': pie_data,
-                    'colors': pie_colors
-                }
+    try:
+        names, principals, rates_percent, rates, payments = parse_debt_form(form)
+
+        chart_data, pie_chart_data = compute_charts(names, principals, rates, payments)
 
-            # --- Add submitted debt data to conversation history ---
-            if submitted_debt_data: # Only add if we successfully parsed some data
-                debt_context_string = "[Debt data submitted via form]\n"
-                debt_context_string += "Current Debt Information:\n"
-                for debt in submitted_debt_data:
-                    name = debt.get('name', 'N/A')
-                    principal = debt.get('principal', 0)
-                    rate = debt.get('rate', 0) # Already in percent from parsing logic above
-                    payment = debt.get('payment', 0)
-                    debt_context_string += f"- Name: {name}, Principal: ${principal:,.2f}, APR: {rate}%, Min Payment: ${payment:,.2f}\n"
-
-                # Append this context as a user message to the history
-                # Check if the last message is identical to avoid duplicates on refresh/resubmit
-                if not conversation_history or conversation_history[-1].get("parts")[0] != debt_context_string:
-                     conversation_history.append({"role": "user", "parts": [debt_context_string]})
-                     print("DEBUG: Added submitted debt data to conversation history.") # Optional debug print
+        store_debt_context(names, principals, rates_percent, rates, payments)
 
+    except Exception as e:
+        print(f"Error processing form data for graphs: {e}")
+        chart_data = None # Ensure charts are not displayed on error
+        pie_chart_data = None
+        # Do not add data to history if there was an error processing it
+
+    return chart_data, pie_chart_data
+
+@app.route('/', methods=['GET','POST'])
+def index():
+    """
+    Serves the main page (GET). A classic debt form submission (POST) renders
+    the page with its chart data embedded; the page's JS uses /api/charts instead.
+    """
+    if request.method == 'POST':
+        chart_data, pie_chart_data = process_debt_form(request.form)
+        charts_json = to_script_json({'chart_data': chart_data, 'pie_chart_data': pie_chart_data})
+        return _TEMPLATE.render(charts_json=charts_json)
+
+    # Serve the pre-rendered page shell, compressed when the browser accepts it
+    use_gzip = request.accept_encodings.quality('gzip') > 0 # "gzip;q=0" refuses it
+    response = Response(INDEX_HTML_GZIP if use_gzip else INDEX_HTML, mimetype='text/html')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(INDEX_HTML_ETAG + ('-gzip' if use_gzip else ''))
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    """
+    Serves static files, preferring a precompressed .br/.gz copy the browser accepts.
+    Vendored bundles requested with their current content hash (?v=...) are cached
+    by browsers and proxies for a year.
+    """
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        compressed = safe_join(STATIC_DIR, filename + suffix)
+        if request.accept_encodings.quality(encoding) > 0 and compressed and os.path.isfile(compressed):
+            response = send_from_directory(STATIC_DIR, filename + suffix, mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(STATIC_DIR, filename)
+    response.vary.add('Accept-Encoding')
+    # Only the hash asset_urls() hands out: a stale or made-up ?v= must not be pinned for a year
+    version = VENDOR_VERSIONS.get(filename)
+    if version is not None and request.args.get('v') == version:
+        response.cache_control.no_cache = None # send_file's default
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+
+@app.route('/api/charts', methods=['POST'])
+def api_charts():
+    """
+    Processes the debt form sent by the page's JS and returns the chart data as JSON.
+    The response carries an ETag of the inputs; when the page resubmits unchanged inputs
+    with If-None-Match, it gets a 304 and keeps its charts without a recomputation.
+    """
+    etag = debt_form_etag(request.form)
+    # Flask-Compress sends compressed responses' ETags with an ":<encoding>" suffix
+    if etag in {tag.partition(':')[0] for tag in request.if_none_match.as_set()}:
+        try:
+            # The charts are unchanged, but this session may not hold the debt context yet
+            store_debt_context(*parse_debt_form(request.form))
         except Exception as e:
             print(f"Error processing form data for graphs: {e}")
-            # Optionally: flash a message to the user
-            # flash(f"Error calculating graph data: {e}", "danger")
-            chart_data = None # Ensure charts are not displayed on error
-            pie_chart_data = None
-            # Do not add data to history if there was an error processing it
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    chart_data, pie_chart_data = process_debt_form(request.form)
+    if chart_data is None:
+        return ojsonify({"error": "Could not process the debt data. Please check the values and try again."}), 400
+    response = ojsonify({"chart_data": chart_data, "pie_chart_data": pie_chart_data})
+    response.set_etag(etag)
+    return response
+
+
+CHAT_ERROR_MESSAGE = "Sorry, I encountered an error trying to process your request. Please check the input data and try again."
+
+# Format one Server-Sent Event carrying a JSON payload
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(payload).decode()}\n\n"
+
+# Yields the AI reply as Server-Sent Events while Gemini generates it, so the first words
+# reach the browser after ~first-token latency instead of after the whole reply.
+# The turns are saved to the history once the stream completes successfully.
+def stream_reply(model, sid, user_message_text, prompt_for_api, new_turns):
+    cache_key = ReplyCache.key(prompt_for_api)
+    ai_message = reply_cache.get(cache_key)
+    if ai_message is not None:
+        yield sse_event({"delta": ai_message}) # Cached: the whole reply in one event
+    else:
+        chunks = []
+        try:
+            with stream_semaphore:
+                for chunk in model.generate_content(prompt_for_api, stream=True):
+                    chunks.append(chunk.text)
+                    yield sse_event({"delta": chunk.text})
+        except Exception as e:
+            print(f"Error streaming content in /chat: {e}")
+            yield sse_event({"reply": CHAT_ERROR_MESSAGE}, event="error")
+            return
+        ai_message = "".join(chunks)
+        reply_cache.put(cache_key, ai_message)
 
-    # Render the combined template, passing chart data if available
-    return render_template_string(HTML_TEMPLATE, chart_data=chart_data, pie_chart_data=pie_chart_data)
+    # Append the user's message and the AI's full response to the history
+    new_turns.append({"role": "model", "parts": [ai_message]})
+    save_turns(sid, new_turns)
+    remember_reply(sid, user_message_text, ai_message)
+    yield sse_event({}, event="done")
 
 
 @app.route('/chat', methods=['POST'])
+@app.route('/chat/stream', methods=['POST'])
 def chat():
-    """Handles chat messages, maintains history, and interacts with the AI."""
-    global conversation_history # Use the global history list
+    """
+    Handles chat messages, maintains history, and interacts with the AI.
+    /chat/stream (or /chat with Accept: text/event-stream) streams the reply as Server-Sent Events.
+    """
 
+    model = get_model()
     if not model:
-        return jsonify({"error": "AI model not configured properly."}), 500
+        return ojsonify({"error": "AI model not configured properly."}), 500
 
     try:
         data = request.get_json()
         if not data or 'message' not in data:
-             return jsonify({"error": "Invalid request data."}), 400
+             return ojsonify({"error": "Invalid request data."}), 400
 
         user_message_text = data.get('message')
         # DEPRECATED: Debt data is now added via the index route form submission
@@ -904,52 +1571,110 @@ def chat():
         # The debt data should already be in the history from the form submission
         # We just need to add the user's current text message.
 
+        sid = get_session_id()
+        wants_stream = request.path == '/chat/stream' or request.accept_mimetypes.best == 'text/event-stream'
+
+        # The same message again right after its reply: answer it from that reply
+        ai_message = recent_reply(sid, user_message_text)
+        if ai_message is not None:
+            if wants_stream:
+                return Response([sse_event({"delta": ai_message}), sse_event({}, event="done")],
+                                mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            return ojsonify({"reply": ai_message})
+
+        conversation_history, debt_context = load_session(sid)
+
+        # Turns are only written to the history once the AI call succeeds
+        new_turns = []
+
         # Append ONLY the user's typed message to the history
         # Check if the message is just a resubmission of the form data context (prevent double add)
         is_form_data_resubmit = user_message_text.startswith("[Debt data submitted via form]")
         if not is_form_data_resubmit:
-            conversation_history.append({"role": "user", "parts": [user_message_text]})
+            new_turns.append({"role": "user", "parts": [user_message_text]})
         else:
             # If it looks like the form data context, check if it's already the last message
             if not conversation_history or conversation_history[-1].get("parts")[0] != user_message_text:
-                 conversation_history.append({"role": "user", "parts": [user_message_text]})
+                 new_turns.append({"role": "user", "parts": [user_message_text]})
             # Else: Do nothing, it's a duplicate submission of the context message
 
 
-        # Construct the prompt for the API call, including the system instruction and the history
-        # The initial system instruction and model response prime the conversation
-        prompt_for_api = [
-            {"role": "user", "parts": [SYSTEM_INSTRUCTION]},
-            {"role": "model", "parts": ["Okay, I understand my role. I will analyze the provided debt information (which might be included with your message or previously submitted via the form) and your messages from our conversation history to help create a repayment plan. Please provide your debt details if you haven't yet, and tell me your total monthly budget for debt repayment."]} # Updated initial model response slightly
-        ]
-        # Add the actual conversation turns
-        prompt_for_api.extend(conversation_history)
+        # Construct the prompt for the API call from the debt context and the (bounded) history
+        prompt_for_api = build_prompt(conversation_history + new_turns, debt_context)
 
-        # Optional: Limit history size to prevent exceeding context window limits
-        # ... (history limiting logic remains unchanged) ...
+        # Stream the reply as Server-Sent Events when the client asks for it (the chat UI does)
+        if wants_stream:
+            return Response(stream_with_context(stream_reply(model, sid, user_message_text, prompt_for_api, new_turns)),
+                            mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-        # Generate content using the model with the full context
-        response = model.generate_content(prompt_for_api)
-        ai_message = response.text
+        # Generate content using the model with the full context (cached, or sent from the shared event loop)
+        ai_message = generate_reply(prompt_for_api).result()
 
-        # Append the AI's response to the history
-        conversation_history.append({"role": "model", "parts": [ai_message]})
+        # Append the user's message and the AI's response to the history
+        new_turns.append({"role": "model", "parts": [ai_message]})
+        save_turns(sid, new_turns)
+        remember_reply(sid, user_message_text, ai_message)
 
     except Exception as e:
         print(f"Error generating content in /chat: {e}")
-        # Attempt to remove the last user message from history if AI call failed
-        # Ensure we don't remove the system-added form data context accidentally
-        if conversation_history and conversation_history[-1]["role"] == "user" and not conversation_history[-1]["parts"][0].startswith("[Debt data submitted via form]"):
-            conversation_history.pop()
-        elif conversation_history and conversation_history[-1]["role"] == "model": # If AI response failed, pop the placeholder
-             conversation_history.pop()
+        # Nothing was written to the history, so a failed call leaves it unchanged
 
 
-        ai_message = "Sorry, I encountered an error trying to process your request. Please check the input data and try again."
+        ai_message = CHAT_ERROR_MESSAGE
         # ... (existing error handling logic remains unchanged) ...
         # ... specific error checks ...
 
-        return jsonify({"reply": ai_message}), 500 # General server error
+        return ojsonify({"reply": ai_message}), 500 # General server error
 
     # Return the AI's reply to the frontend
-    return jsonify({"reply": ai_message})
+    return ojsonify({"reply": ai_message})
+
+
+@app.route('/chat_batch', methods=['POST'])
+def chat_batch():
+    """
+    Answers several "what-if" scenarios (e.g. different monthly budgets) against
+    the current conversation in one request. Scenarios are not added to the history.
+    """
+    if not get_model():
+        return ojsonify({"error": "AI model not configured properly."}), 500
+
+    data = request.get_json(silent=True)
+    scenarios = data.get('scenarios') if isinstance(data, dict) else None
+    if (not isinstance(scenarios, list) or not 0 < len(scenarios) <= BATCH_MAX_SCENARIOS
+            or not all(isinstance(s, str) and s.strip() for s in scenarios)):
+        return ojsonify({"error": f"Provide between 1 and {BATCH_MAX_SCENARIOS} scenario messages."}), 400
+
+    # Every scenario shares the same prompt prefix; only the final user turn differs
+    base_prompt = build_prompt(*load_session(get_session_id()))
+
+    # google-generativeai has no Batch API; submitting the scenarios together lets the
+    # dispatcher run them as concurrent calls instead of one after another
+    futures = [generate_reply(base_prompt + [{"role": "user", "parts": [scenario]}]) for scenario in scenarios]
+    replies = []
+    for future in futures:
+        try:
+            replies.append(future.result())
+        except Exception as e:
+            print(f"Error generating content in /chat_batch: {e}")
+            replies.append(None)
+    results = [
+        {"key": f"scenario_{i}", "reply": reply if reply is not None else "Sorry, I encountered an error processing this scenario.", "ok": reply is not None}
+        for i, reply in enumerate(replies)
+    ]
+    return ojsonify({"results": results})
+
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Reports this worker's Gemini reply cache size and hit/miss counts."""
+    return ojsonify(reply_cache.stats())
+
+
+# Local runs (`python app.py`) use Flask's threaded dev server; production runs under gunicorn
+# (see gunicorn.conf.py). The debugger and reloader are only enabled with FLASK_DEBUG=1: the
+# reloader imports the app twice, and the debugger must never be reachable in production.
+if __name__ == '__main__':
+    app.run(host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', '5000')),
+            debug=os.getenv('FLASK_DEBUG') == '1', threaded=True)
@@ -0,0 +1,22 @@
+#!/usr/bin/env sh
+# Vendors the front-end bundles into static/vendor so the page doesn't load them from CDNs:
+# Bootstrap and Chart.js as-is, Tailwind as a purged CSS build instead of the runtime JIT
+# script, each with .br and .gz copies. Needs curl, npx (Node), brotli and gzip.
+# Restart the app afterwards; it switches to the vendored files when they exist.
+set -eu
+cd "$(dirname "$0")"
+
+VENDOR=static/vendor
+mkdir -p "$VENDOR"
+
+curl -fsSL -o "$VENDOR/bootstrap.min.css" https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css
+curl -fsSL -o "$VENDOR/bootstrap.bundle.min.js" https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js
+curl -fsSL -o "$VENDOR/chart.umd.min.js" https://cdn.jsdelivr.net/npm/chart.js@4/dist/chart.umd.min.js
+
+# Only the classes used by the page template (in app.py) end up in the CSS
+npx --yes tailwindcss@3 -i static/src/tailwind.css -o "$VENDOR/tailwind.min.css" --content app.py --minify
+
+for f in "$VENDOR"/*.css "$VENDOR"/*.js; do
+    brotli -f -q 11 -o "$f.br" "$f"
+    gzip -f -9 -k "$f"
+done
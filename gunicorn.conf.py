@@ -0,0 +1,23 @@
+# Gunicorn settings (read automatically by `gunicorn app:app`)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+# /chat spends seconds waiting on Gemini's HTTPS response. With the default sync workers each
+# of those waits pins a whole worker, capping concurrent chats at the worker count.
+# Threaded workers release the GIL while the SDK waits on the network, so one process keeps
+# serving other requests (and other chats) in the meantime.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+# No timeout override: gthread workers heartbeat from their own loop every second whatever the
+# request threads are doing, so `timeout` only catches a hung worker process and never limits
+# how long a request (e.g. a streamed chat reply) stays open.
+
+# Import the app once in the master and fork the workers from it: NumPy/Numba (and the
+# prewarmed kernel, page shell, etc.) are loaded once and shared copy-on-write instead of
+# being imported again by every worker. Everything that isn't fork-safe (the Gemini SDK, the
+# chat dispatcher's thread) is created lazily inside the workers.
+# It also means all workers share the random fallback secret key when FLASK_SECRET_KEY is unset.
+preload_app = True